@@ -0,0 +1,56 @@
+# Admin tool: fetch server latency metrics or trigger a profile capture.
+#
+# Usage: python3 admin.py server_port stats
+#        python3 admin.py server_port profile [seconds]
+#
+# The server only accepts these from users listed in its ADMIN_USERS.
+
+import sys
+import json
+import socket
+from protocols import decode_message, encode_message
+
+if len(sys.argv) < 3 or sys.argv[2] not in ("stats", "profile"):
+    print("Usage: python3 admin.py server_port stats|profile [seconds]")
+    sys.exit(1)
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = int(sys.argv[1])
+SERVER_ADDRESS = (SERVER_HOST, SERVER_PORT)
+BUFFER_SIZE = 65535 # metrics can outgrow the client buffer
+
+
+def main():
+    username = input("Enter username: ")
+    password = input("Enter password: ")
+
+    if sys.argv[2] == "stats":
+        message = encode_message(type="STATS", username=username, password=password)
+    else:
+        seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+        message = encode_message(
+            type="PROFILE", username=username, password=password, seconds=seconds
+        )
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(5)
+        s.sendto(message, SERVER_ADDRESS)
+        try:
+            data, _ = s.recvfrom(BUFFER_SIZE)
+        except socket.timeout:
+            print("No response from server.")
+            sys.exit(1)
+
+    response = decode_message(data)
+    if response.get("status") != "OK":
+        print(f"Request failed: {response.get('reason')}")
+    elif response.get("type") == "STATS_RESPONSE":
+        print(json.dumps(response.get("metrics"), indent=2))
+    else:
+        print(
+            f"Profiling for {response.get('seconds')}s, report will be written to '{response.get('report')}'."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Memory benchmark for the server's publication index.
+#
+# Usage: python3 bench_index.py [files] [publishers_per_file] [users ...]
+
+import sys
+import tracemalloc
+from index import PublicationIndex
+
+
+def publications(users, files, publishers_per_file):
+    # Filenames arrive as freshly decoded strings on every PUB message, so
+    # build a new string object for each publication just like the server sees.
+    for file_number in range(files):
+        for offset in range(publishers_per_file):
+            username = f"user{(file_number + offset) % users}"
+            filename = "".join(["dataset-", str(file_number), ".csv"])
+            yield username, filename
+
+
+def build_sets(stream):
+    user_published_files = {}
+    file_to_users = {}
+    for username, filename in stream:
+        user_published_files.setdefault(username, set()).add(filename)
+        file_to_users.setdefault(filename, set()).add(username)
+    return user_published_files, file_to_users
+
+
+def build_index(stream):
+    index = PublicationIndex()
+    for username, filename in stream:
+        index.publish(username, filename)
+    return index
+
+
+def measure(build, users, files, publishers_per_file):
+    tracemalloc.start()
+    structure = build(publications(users, files, publishers_per_file))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del structure
+    return size
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    publishers_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    user_counts = [int(arg) for arg in sys.argv[3:]] or [10, 100, 1000, 10000, 100000]
+    count = files * publishers_per_file
+
+    print(f"{count} publications ({files} files, {publishers_per_file} publishers each)")
+    print(f"{'users':>8} {'dict of sets':>14} {'PublicationIndex':>18}  (bytes/publication)")
+    for users in user_counts:
+        before = measure(build_sets, users, files, publishers_per_file)
+        after = measure(build_index, users, files, publishers_per_file)
+        print(f"{users:>8} {before / count:>14.1f} {after / count:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
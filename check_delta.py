@@ -0,0 +1,104 @@
+# Randomised round-trip check for delta transfers.
+#
+# Usage: python3 check_delta.py [trials] [seed]
+#
+# Rebuilds edited copies of random files over a socket pair and asserts the
+# result is byte-identical, then checks that large insertions only cost
+# about as many literal bytes as were inserted.
+
+import io
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import delta
+from delta import block_signatures, block_size_for, receive_delta, send_delta
+
+
+def round_trip(directory, old, new, block_size=None):
+    """Rebuild new from old through send_delta/receive_delta."""
+    filename = os.path.join(directory, "basis.bin")
+    with open(filename, "wb") as f:
+        f.write(old)
+    block_size = block_size or block_size_for(len(old))
+    with open(filename, "rb") as f:
+        signatures = block_signatures(f, block_size)
+
+    seeder, downloader = socket.socketpair()
+
+    def seed():
+        with seeder:
+            send_delta(seeder, io.BytesIO(new), signatures, block_size)
+
+    thread = threading.Thread(target=seed)
+    thread.start()
+    with downloader:
+        literal_bytes = receive_delta(downloader, filename, block_size)
+    thread.join()
+
+    with open(filename, "rb") as f:
+        assert f.read() == new, "rebuilt file differs from the seeder's copy"
+    return literal_bytes
+
+
+def random_edit(rng, old):
+    new = bytearray(old)
+    for _ in range(rng.randrange(5)):
+        position = rng.randrange(len(new) + 1)
+        removed = rng.randrange(rng.choice([50, 5000]))
+        new[position:position + removed] = rng.randbytes(rng.randrange(rng.choice([100, 6000])))
+    if rng.random() < 0.5:
+        new += rng.randbytes(rng.randrange(3000))
+    return bytes(new)
+
+
+def check_random_edits(directory, rng, trials):
+    for _ in range(trials):
+        old = rng.randbytes(rng.randrange(40000))
+        block_size = rng.choice([None, delta.MIN_BLOCK_SIZE, 1500])
+        round_trip(directory, old, random_edit(rng, old), block_size)
+    print(f"{trials} random edits rebuilt correctly")
+
+
+def check_large_insertions(directory, rng):
+    old = rng.randbytes(8 << 20)
+    block_size = block_size_for(len(old))
+    # Everything past the insertion still has to be found again, whatever
+    # its alignment, at the cost of at most a few skipped blocks.
+    slack = (delta.SKIP_BLOCKS + 2) * block_size
+    middle = len(old) // 2
+    for label, position, size in (
+        ("prepend", 0, 200000),
+        ("prepend", 0, 300001),
+        ("middle", middle, 300001),
+        ("middle", middle, 1000003),
+    ):
+        new = old[:position] + rng.randbytes(size) + old[position:]
+        literal_bytes = round_trip(directory, old, new)
+        print(f"{label} {size} bytes: {literal_bytes} literal bytes")
+        assert size <= literal_bytes <= size + slack, "insertion was not re-synchronised"
+
+    literal_bytes = round_trip(directory, old, old)
+    assert literal_bytes == 0, "unchanged file sent literal bytes"
+
+
+def main():
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        check_random_edits(directory, rng, trials)
+        # A tiny scan limit pushes the random edits through the skip path too.
+        scan_limit, delta.SCAN_LIMIT = delta.SCAN_LIMIT, 512
+        try:
+            check_random_edits(directory, rng, trials)
+        finally:
+            delta.SCAN_LIMIT = scan_limit
+        check_large_insertions(directory, rng)
+    print("All delta checks passed.")
+
+
+if __name__ == "__main__":
+    main()
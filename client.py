@@ -3,7 +3,21 @@ import socket
 import threading
 import time
 import os
-from protocols import decode_message, encode_message
+from protocols import decode_message, decode_message_prefix, encode_message
+from delta import (
+    MAX_BLOCK_SIZE,
+    MIN_BLOCK_SIZE,
+    MIN_DELTA_SIZE,
+    SIGNATURE,
+    block_signatures,
+    block_size_for,
+    pack_signatures,
+    receive_delta,
+    recv_exact,
+    send_delta,
+    unpack_signatures,
+)
+from metrics import MessageMetrics, start_periodic_dump
 
 if len(sys.argv) != 2:
     print("Usage: python3 client.py server_port")
@@ -13,6 +27,10 @@ SERVER_HOST = "127.0.0.1"
 SERVER_PORT = int(sys.argv[1])
 SERVER_ADDRESS = (SERVER_HOST, SERVER_PORT)
 BUFFER_SIZE = 2048 # extra memory just in case
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "10"))
+
+metrics = MessageMetrics(("FILE_REQUEST", "DELTA_REQUEST"))
 
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 client_socket.settimeout(5)
@@ -37,9 +55,11 @@ def tcp_server():
 
 
 def handle_file_request(conn, addr):
+    start = time.monotonic()
+    message = {}
     try:
         data = conn.recv(1024)
-        message = decode_message(data)
+        message, remainder = decode_message_prefix(data)
         if message.get("type") == "FILE_REQUEST":
             filename = message.get("filename")
             if os.path.isfile(filename):
@@ -52,12 +72,29 @@ def handle_file_request(conn, addr):
                 print(f"File '{filename}' sent to peer")
             else:
                 print(f"Requested file '{filename}' not found.")
+        elif message.get("type") == "DELTA_REQUEST":
+            filename = message.get("filename")
+            block_size = int(message.get("block_size", 0))
+            block_count = int(message.get("block_count", 0))
+            if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+                print(f"Received invalid delta request from peer")
+            elif os.path.isfile(filename):
+                remaining = block_count * SIGNATURE.size - len(remainder)
+                signatures = unpack_signatures(remainder + recv_exact(conn, remaining))
+                with open(filename, "rb") as f:
+                    literal_bytes = send_delta(conn, f, signatures, block_size)
+                print(
+                    f"File '{filename}' sent to peer as delta ({literal_bytes} new bytes)"
+                )
+            else:
+                print(f"Requested file '{filename}' not found.")
         else:
             print(f"Received invalid file request from peer")
     except Exception as e:
         print(f"Error handling file request from {addr}: {e}")
     finally:
         conn.close()
+        metrics.record(message.get("type"), "upload", time.monotonic() - start)
 
 
 def pluralize(count, singular, plural=None):
@@ -104,6 +141,9 @@ def main():
 
     threading.Thread(target=tcp_server, daemon=True).start()
 
+    if METRICS_FILE:
+        start_periodic_dump(metrics, METRICS_FILE, METRICS_INTERVAL)
+
     try:
         while True:
             cmd = input("> ").strip()
@@ -313,9 +353,21 @@ def main():
 
 
 def download_file(filename, peer_ip, peer_tcp_port):
+    start = time.monotonic()
+    # Small local copies are cheaper to replace outright than to sign.
+    if os.path.isfile(filename) and os.path.getsize(filename) >= MIN_DELTA_SIZE:
+        request_type = "DELTA_REQUEST"
+    else:
+        request_type = "FILE_REQUEST"
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((peer_ip, int(peer_tcp_port)))
+            if request_type == "DELTA_REQUEST":
+                literal_bytes = download_delta(s, filename)
+                print(
+                    f"'{filename}' updated successfully ({literal_bytes} new bytes)"
+                )
+                return
             message = encode_message(type="FILE_REQUEST", filename=filename)
             s.sendall(message)
             with open(filename, "wb") as f:
@@ -327,6 +379,23 @@ def download_file(filename, peer_ip, peer_tcp_port):
             print(f"'{filename}' downloaded successfully")
     except Exception as e:
         print(f"Failed to download file '{filename}': {e}")
+    finally:
+        metrics.record(request_type, "download", time.monotonic() - start)
+
+
+def download_delta(s, filename):
+    # Send signatures of the local copy so the peer only streams what changed.
+    with open(filename, "rb") as f:
+        block_size = block_size_for(os.fstat(f.fileno()).st_size)
+        signatures = block_signatures(f, block_size)
+    message = encode_message(
+        type="DELTA_REQUEST",
+        filename=filename,
+        block_size=block_size,
+        block_count=len(signatures),
+    )
+    s.sendall(message + pack_signatures(signatures))
+    return receive_delta(s, filename, block_size)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+# Rolling-checksum delta transfer between peers, in the style of rsync.
+#
+# The downloader splits its stale copy into blocks and sends a signature for
+# each one. The seeder slides a window over its current copy and answers with
+# COPY instructions for blocks the downloader already has and LITERAL bytes
+# for everything else.
+
+import hashlib
+import math
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 65536
+MIN_DELTA_SIZE = 1 << 20
+READ_SIZE = 65536
+SCAN_LIMIT = 1 << 18
+SKIP_BLOCKS = 15
+ADLER_MOD = 65521
+
+SIGNATURE = struct.Struct("!I16s")
+LENGTH = struct.Struct("!I")
+
+COPY = b"C"
+LITERAL = b"L"
+END = b"E"
+
+
+class DeltaError(Exception):
+    pass
+
+
+def block_size_for(file_size):
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, math.isqrt(file_size)))
+
+
+def strong_checksum(data):
+    return hashlib.md5(data).digest()
+
+
+def block_signatures(f, block_size):
+    signatures = []
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        signatures.append((zlib.adler32(block), strong_checksum(block)))
+    return signatures
+
+
+def pack_signatures(signatures):
+    return b"".join(SIGNATURE.pack(weak, strong) for weak, strong in signatures)
+
+
+def unpack_signatures(data):
+    return list(SIGNATURE.iter_unpack(data))
+
+
+def generate_delta(f, signatures, block_size, digest):
+    """Yield (COPY, block_index) and (LITERAL, bytes) ops rebuilding f.
+
+    Every byte read from f is also fed to digest. The weak checksum is
+    adler32, rolled one byte at a time in unmatched regions. Once a run of
+    SCAN_LIMIT bytes goes by without a match, rolling becomes the slow part,
+    so the scan alternates between skipping SKIP_BLOCKS blocks as literal
+    data and rolling over one block's worth of offsets. Every block_size
+    consecutive offsets include one aligned with the downloader's blocks
+    wherever the files agree again, so matching still re-synchronises at
+    most SKIP_BLOCKS + 1 blocks after the end of a large edit.
+    """
+    lookup = {}
+    for index, (weak, strong) in enumerate(signatures):
+        lookup.setdefault(weak, {}).setdefault(strong, index)
+
+    buffer = bytearray()
+    offset = literal_start = 0
+    eof = False
+    rolling = None
+    budget = SCAN_LIMIT
+    skip = 0
+
+    while True:
+        # Keep one byte past the window so the checksum can roll forward.
+        if not eof and len(buffer) - offset <= block_size:
+            if literal_start < offset:
+                yield LITERAL, bytes(buffer[literal_start:offset])
+            del buffer[:offset]
+            offset = literal_start = 0
+            chunk = f.read(READ_SIZE)
+            if chunk:
+                digest.update(chunk)
+                buffer += chunk
+            else:
+                eof = True
+            continue
+
+        if skip:
+            step = min(skip, len(buffer) - offset)
+            offset += step
+            skip -= step
+            if skip and not eof:
+                continue
+            skip = 0
+            rolling = None
+            budget = block_size
+
+        end = min(offset + block_size, len(buffer))
+        length = end - offset
+        if not length:
+            break
+        if rolling is None:
+            rolling = zlib.adler32(buffer[offset:end])
+        a = rolling & 0xFFFF
+        b = rolling >> 16
+
+        index = None
+        buffer_end = len(buffer)
+        while True:
+            candidates = lookup.get((b << 16) | a)
+            if candidates is not None:
+                index = candidates.get(strong_checksum(buffer[offset:end]))
+                if index is not None:
+                    break
+            if end >= buffer_end or budget <= 0:
+                break
+            out = buffer[offset]
+            a = (a - out + buffer[end]) % ADLER_MOD
+            b = (b - length * out + a - 1) % ADLER_MOD
+            offset += 1
+            end += 1
+            budget -= 1
+
+        if index is not None:
+            if literal_start < offset:
+                yield LITERAL, bytes(buffer[literal_start:offset])
+            yield COPY, index
+            offset = literal_start = end
+            rolling = None
+            budget = SCAN_LIMIT
+        elif budget <= 0:
+            skip = SKIP_BLOCKS * block_size
+        elif eof:
+            # Past the last full window: shrink it from the front.
+            out = buffer[offset]
+            a = (a - out) % ADLER_MOD
+            b = (b - length * out - 1) % ADLER_MOD
+            offset += 1
+            rolling = (b << 16) | a
+        else:
+            rolling = (b << 16) | a
+
+    if literal_start < offset:
+        yield LITERAL, bytes(buffer[literal_start:offset])
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), READ_SIZE))
+        if not chunk:
+            raise DeltaError("Connection closed mid-transfer.")
+        data += chunk
+    return bytes(data)
+
+
+def send_delta(sock, f, signatures, block_size):
+    """Stream the delta for f to sock. Returns the number of literal bytes.
+
+    END is followed by the MD5 of the whole file so the receiver can check
+    its reconstruction.
+    """
+    literal_bytes = 0
+    digest = hashlib.md5()
+    for op, value in generate_delta(f, signatures, block_size, digest):
+        if op == COPY:
+            sock.sendall(COPY + LENGTH.pack(value))
+        else:
+            sock.sendall(LITERAL + LENGTH.pack(len(value)) + value)
+            literal_bytes += len(value)
+    sock.sendall(END + digest.digest())
+    return literal_bytes
+
+
+def receive_delta(sock, filename, block_size):
+    """Rebuild filename from its local copy and the delta read from sock.
+
+    The result is written to a temp file next to filename and renamed over
+    it only once the END marker arrives and the whole-file checksum after it
+    matches, so a dropped connection or a bad reconstruction leaves the old
+    copy untouched. Returns the number of literal bytes received.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".delta-")
+    literal_bytes = 0
+    digest = hashlib.md5()
+    try:
+        with os.fdopen(fd, "wb") as out, open(filename, "rb") as basis:
+            while True:
+                op = recv_exact(sock, 1)
+                if op == END:
+                    break
+                (value,) = LENGTH.unpack(recv_exact(sock, LENGTH.size))
+                if op == COPY:
+                    basis.seek(value * block_size)
+                    data = basis.read(block_size)
+                elif op == LITERAL:
+                    data = recv_exact(sock, value)
+                    literal_bytes += value
+                else:
+                    raise DeltaError(f"Unknown delta instruction {op!r}.")
+                out.write(data)
+                digest.update(data)
+        if recv_exact(sock, digest.digest_size) != digest.digest():
+            raise DeltaError("Checksum mismatch, local copy left unchanged.")
+        shutil.copymode(filename, temp_path)
+        os.replace(temp_path, filename)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return literal_bytes
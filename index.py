@@ -0,0 +1,113 @@
+# Compact publication index: which users publish which files.
+
+from array import array
+from bisect import bisect_left
+
+
+class PublicationIndex:
+    """Maps users to published files and files to publishers.
+
+    Filenames and usernames are interned once and referred to by integer
+    IDs everywhere else. Each user's files are kept as a sorted array of
+    file IDs and each file's publishers as a sorted array of user IDs. The
+    cost is one array("I") per file and per user plus each name stored
+    once, a third to a half of the two sets and duplicated strings it
+    replaces (see bench_index.py).
+    """
+
+    __slots__ = (
+        "_file_ids",
+        "_file_names",
+        "_file_users",
+        "_free_file_ids",
+        "_user_ids",
+        "_user_names",
+        "_user_files",
+    )
+
+    def __init__(self):
+        self._file_ids = {}
+        self._file_names = []
+        self._file_users = []
+        self._free_file_ids = []
+        self._user_ids = {}
+        self._user_names = []
+        self._user_files = []
+
+    def _intern_user(self, username):
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            user_id = len(self._user_names)
+            self._user_ids[username] = user_id
+            self._user_names.append(username)
+            self._user_files.append(array("I"))
+        return user_id
+
+    def _intern_file(self, filename):
+        file_id = self._file_ids.get(filename)
+        if file_id is None:
+            if self._free_file_ids:
+                file_id = self._free_file_ids.pop()
+                self._file_names[file_id] = filename
+            else:
+                file_id = len(self._file_names)
+                self._file_names.append(filename)
+                self._file_users.append(array("I"))
+            self._file_ids[filename] = file_id
+        return file_id
+
+    def _release_file(self, file_id):
+        del self._file_ids[self._file_names[file_id]]
+        self._file_names[file_id] = None
+        self._free_file_ids.append(file_id)
+
+    def _users_in(self, file_id):
+        return [self._user_names[user_id] for user_id in self._file_users[file_id]]
+
+    def publish(self, username, filename):
+        """Record a publication. Returns False if it already existed."""
+        user_id = self._intern_user(username)
+        file_id = self._intern_file(filename)
+        files = self._user_files[user_id]
+        position = bisect_left(files, file_id)
+        if position < len(files) and files[position] == file_id:
+            return False
+        files.insert(position, file_id)
+        users = self._file_users[file_id]
+        users.insert(bisect_left(users, user_id), user_id)
+        return True
+
+    def unpublish(self, username, filename):
+        """Remove a publication. Returns False if it did not exist."""
+        user_id = self._user_ids.get(username)
+        file_id = self._file_ids.get(filename)
+        if user_id is None or file_id is None:
+            return False
+        files = self._user_files[user_id]
+        position = bisect_left(files, file_id)
+        if position == len(files) or files[position] != file_id:
+            return False
+        del files[position]
+        users = self._file_users[file_id]
+        del users[bisect_left(users, user_id)]
+        if not users:
+            self._release_file(file_id)
+        return True
+
+    def files_of(self, username):
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            return []
+        return [self._file_names[file_id] for file_id in self._user_files[user_id]]
+
+    def publishers_of(self, filename):
+        file_id = self._file_ids.get(filename)
+        if file_id is None:
+            return []
+        return self._users_in(file_id)
+
+    def search(self, substring):
+        """Yield (filename, publishers) for every file containing substring."""
+        for filename, file_id in self._file_ids.items():
+            if substring in filename:
+                yield filename, self._users_in(file_id)
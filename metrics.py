@@ -0,0 +1,195 @@
+# Latency histograms and on-demand profiling for the hot paths.
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from utils import start_thread
+
+BUCKET_COUNT = 26  # power-of-two microsecond buckets, the last is ~33s and up
+
+
+class LatencyHistogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1_000_000).bit_length()
+        self.buckets[min(bucket, BUCKET_COUNT - 1)] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the requested rank, in seconds.
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) / 1_000_000, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "buckets_us": {
+                f"<{1 << bucket}": count
+                for bucket, count in enumerate(self.buckets)
+                if count
+            },
+        }
+
+
+class MessageMetrics:
+    """Latency histograms keyed by message type and phase.
+
+    Message types come straight off the wire, so anything outside
+    message_types is counted as UNKNOWN to keep the key set small.
+    """
+
+    def __init__(self, message_types):
+        self._message_types = frozenset(message_types)
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def record(self, message_type, phase, seconds):
+        if not isinstance(message_type, str) or message_type not in self._message_types:
+            message_type = "UNKNOWN"
+        key = (message_type, phase)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def locked(self, lock, message_type):
+        # Separates time spent waiting for lock from time spent holding it.
+        start = time.monotonic()
+        lock.acquire()
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            released = time.monotonic()
+            lock.release()
+            self.record(message_type, "lock_wait", acquired - start)
+            self.record(message_type, "lock_held", released - acquired)
+
+    def snapshot(self):
+        with self._lock:
+            items = sorted(self._histograms.items())
+            result = {}
+            for (message_type, phase), histogram in items:
+                result.setdefault(message_type, {})[phase] = histogram.snapshot()
+        return result
+
+    def dump(self, filename):
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "w") as f:
+            json.dump(
+                {"timestamp": time.time(), "metrics": self.snapshot()}, f, indent=2
+            )
+        os.replace(temp_filename, filename)
+
+
+def start_periodic_dump(metrics, filename, interval):
+    def dump_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.dump(filename)
+            except OSError as e:
+                print(f"Failed to write metrics to '{filename}': {e}")
+
+    return start_thread(dump_forever)
+
+
+class ProfileCapture:
+    """Time-boxed cProfile + tracemalloc capture across handler threads.
+
+    On Python 3.11 cProfile only sees the thread it is enabled in, so each
+    call made through run() while a capture is active gets its own profiler,
+    and the results are merged into one report when the capture ends. From
+    3.12 a profiler sees every thread but only one may be active at a time,
+    so calls that overlap an active one simply run unprofiled.
+    """
+
+    def __init__(self, directory="profiles"):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._profiles = None
+
+    def start(self, seconds):
+        """Begin a capture. Returns the report path, or None if one is running."""
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(
+            self.directory, time.strftime("profile-%Y%m%d-%H%M%S.txt")
+        )
+        with self._lock:
+            if self._profiles is not None:
+                return None
+            self._profiles = []
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        start_thread(self._finish, seconds, filename, started_tracemalloc)
+        return filename
+
+    def run(self, func, *args):
+        if self._profiles is None:
+            return func(*args)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._profiles is not None:
+                    self._profiles.append(profile)
+
+    def _finish(self, seconds, filename, started_tracemalloc):
+        try:
+            time.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_tracemalloc:
+                tracemalloc.stop()
+            with self._lock:
+                profiles, self._profiles = self._profiles, None
+
+        report = io.StringIO()
+        report.write(f"Capture of {seconds}s, {len(profiles)} profiled calls\n\n")
+        if profiles:
+            stats = pstats.Stats(*profiles, stream=report)
+            stats.sort_stats("cumulative").print_stats(40)
+        report.write("Top allocations by line\n\n")
+        for stat in snapshot.statistics("lineno")[:25]:
+            report.write(f"{stat}\n")
+
+        try:
+            with open(filename, "w") as f:
+                f.write(report.getvalue())
+            print(f"Profile report written to '{filename}'.")
+        except OSError as e:
+            print(f"Failed to write profile report to '{filename}': {e}")
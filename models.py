@@ -3,6 +3,8 @@
 import time
 
 class ActiveUser:
+    __slots__ = ("username", "address", "tcp_port", "last_heartbeat")
+
     def __init__(self, username, address, tcp_port):
         self.username = username
         self.address = address
@@ -8,6 +8,18 @@ def encode_message(**kwargs):
 def decode_message(data):
     try:
         message = json.loads(data.decode())
-        return message
-    except json.JSONDecodeError:
+    except (UnicodeDecodeError, json.JSONDecodeError):
         return {}
+    # Every message is an object; anything else is treated as malformed.
+    return message if isinstance(message, dict) else {}
+
+def decode_message_prefix(data):
+    # Split a message off the front of data and return the bytes after it.
+    # encode_message output is pure ASCII, so latin-1 keeps offsets aligned.
+    try:
+        message, end = json.JSONDecoder().raw_decode(data.decode("latin-1"))
+    except json.JSONDecodeError:
+        return {}, b""
+    if not isinstance(message, dict):
+        return {}, b""
+    return message, data[end:]
@@ -1,3 +1,4 @@
+import os
 import sys
 import socket
 import threading
@@ -6,6 +7,8 @@ from datetime import datetime
 from credentials import load_credentials
 from protocols import decode_message, encode_message
 from models import ActiveUser
+from index import PublicationIndex
+from metrics import MessageMetrics, ProfileCapture, start_periodic_dump
 
 if len(sys.argv) != 2:
     print("Usage: python3 server.py server_port")
@@ -15,12 +18,31 @@ SERVER_HOST = "127.0.0.1"
 SERVER_PORT = int(sys.argv[1])
 ADDRESS = (SERVER_HOST, SERVER_PORT)
 BUFFER_SIZE = 2048 # extra memory just in case
+ADMIN_USERS = set(filter(None, os.environ.get("ADMIN_USERS", "").split(",")))
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "10"))
+PROFILE_MAX_SECONDS = 60
 
 credentials = load_credentials()
 active_users = {}
-user_published_files = {}
-file_to_users = {}
+publications = PublicationIndex()
 lock = threading.Lock()
+metrics = MessageMetrics(
+    (
+        "AUTH",
+        "HEARTBEAT",
+        "LAP",
+        "LPF",
+        "PUB",
+        "SCH",
+        "UNP",
+        "GET",
+        "STATS",
+        "PROFILE",
+        "INACTIVE_SWEEP",
+    )
+)
+profiler = ProfileCapture()
 
 server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 server_socket.bind(ADDRESS)
@@ -31,8 +53,24 @@ def get_timestamp():
     return datetime.now().strftime("%H:%M:%S.%f")[:-3]
 
 
+def is_admin(message):
+    username = message.get("username")
+    return (
+        username in ADMIN_USERS
+        and credentials.get(username) == message.get("password")
+    )
+
+
 def handle_client_message(data, client_address):
+    start = time.monotonic()
     message = decode_message(data)
+    try:
+        profiler.run(dispatch_message, message, client_address)
+    finally:
+        metrics.record(message.get("type"), "handler", time.monotonic() - start)
+
+
+def dispatch_message(message, client_address):
     message_type = message.get("type")
     client_port = client_address[1]
     timestamp = get_timestamp()
@@ -43,7 +81,7 @@ def handle_client_message(data, client_address):
         tcp_port = message.get("tcp_port")
         response = {"type": "AUTH_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in credentials:
                 response["status"] = "FAIL"
                 response["reason"] = "Username not found."
@@ -73,7 +111,7 @@ def handle_client_message(data, client_address):
 
     elif message_type == "HEARTBEAT":
         username = message.get("username")
-        with lock:
+        with metrics.locked(lock, message_type):
             if username in active_users:
                 active_users[username].update_heartbeat()
                 print(
@@ -84,7 +122,7 @@ def handle_client_message(data, client_address):
         username = message.get("username")
         response = {"type": "LAP_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in active_users:
                 response["status"] = "FAIL"
                 response["reason"] = "User not authenticated."
@@ -111,7 +149,7 @@ def handle_client_message(data, client_address):
         username = message.get("username")
         response = {"type": "LPF_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in active_users:
                 response["status"] = "FAIL"
                 response["reason"] = "User not authenticated."
@@ -119,7 +157,7 @@ def handle_client_message(data, client_address):
                     f"{timestamp}: {client_port}: LPF request failed for user '{username}' - not authenticated."
                 )
             else:
-                files = list(user_published_files.get(username, []))
+                files = publications.files_of(username)
                 file_count = len(files)
                 if files:
                     response["status"] = "OK"
@@ -141,7 +179,7 @@ def handle_client_message(data, client_address):
         filename = message.get("filename")
         response = {"type": "PUB_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in active_users:
                 response["status"] = "FAIL"
                 response["reason"] = "User not authenticated."
@@ -149,19 +187,13 @@ def handle_client_message(data, client_address):
                     f"{timestamp}: {client_port}: PUB request failed for user '{username}' - not authenticated."
                 )
             else:
-                if username not in user_published_files:
-                    user_published_files[username] = set()
-                if filename in user_published_files[username]:
+                if not publications.publish(username, filename):
                     response["status"] = "OK"
                     response["message"] = "File published successfully."
                     print(
                         f"{timestamp}: {client_port}: User '{username}' attempted to publish '{filename}' which is already published."
                     )
                 else:
-                    user_published_files[username].add(filename)
-                    if filename not in file_to_users:
-                        file_to_users[filename] = set()
-                    file_to_users[filename].add(username)
                     response["status"] = "OK"
                     response["message"] = "File published successfully."
                     print(
@@ -175,7 +207,7 @@ def handle_client_message(data, client_address):
         substring = message.get("substring")
         response = {"type": "SCH_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in active_users:
                 response["status"] = "FAIL"
                 response["reason"] = "User not authenticated."
@@ -183,17 +215,10 @@ def handle_client_message(data, client_address):
                     f"{timestamp}: {client_port}: SCH request failed for user '{username}' - not authenticated."
                 )
             else:
-                all_matching_files = set()
-                for file, users in file_to_users.items():
-                    if substring in file:
-                        all_matching_files.add(file)
-
-                user_files = user_published_files.get(username, set())
-                filtered_files = all_matching_files - user_files
-
                 final_matching_files = []
-                for file in filtered_files:
-                    publishers = file_to_users.get(file, set())
+                for file, publishers in publications.search(substring):
+                    if username in publishers:
+                        continue
                     if any(publisher in active_users for publisher in publishers):
                         final_matching_files.append(file)
 
@@ -216,7 +241,7 @@ def handle_client_message(data, client_address):
         filename = message.get("filename")
         response = {"type": "UNP_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in active_users:
                 response["status"] = "FAIL"
                 response["reason"] = "User not authenticated."
@@ -224,15 +249,7 @@ def handle_client_message(data, client_address):
                     f"{timestamp}: {client_port}: UNP request failed for user '{username}' - not authenticated."
                 )
             else:
-                if (
-                    username in user_published_files
-                    and filename in user_published_files[username]
-                ):
-                    user_published_files[username].remove(filename)
-                    if filename in file_to_users:
-                        file_to_users[filename].discard(username)
-                        if not file_to_users[filename]:
-                            del file_to_users[filename]
+                if publications.unpublish(username, filename):
                     response["status"] = "OK"
                     response["message"] = "File unpublished successfully."
                     print(
@@ -252,7 +269,7 @@ def handle_client_message(data, client_address):
         filename = message.get("filename")
         response = {"type": "GET_RESPONSE"}
 
-        with lock:
+        with metrics.locked(lock, message_type):
             if username not in active_users:
                 response["status"] = "FAIL"
                 response["reason"] = "User not authenticated."
@@ -261,8 +278,8 @@ def handle_client_message(data, client_address):
                 )
             else:
                 peers_with_file = []
-                for user, files in user_published_files.items():
-                    if user != username and filename in files and user in active_users:
+                for user in publications.publishers_of(filename):
+                    if user != username and user in active_users:
                         peer_user = active_users[user]
                         peers_with_file.append(peer_user)
                 if peers_with_file:
@@ -286,6 +303,51 @@ def handle_client_message(data, client_address):
         )
         server_socket.sendto(encode_message(**response), client_address)
 
+    elif message_type == "STATS":
+        response = {"type": "STATS_RESPONSE"}
+        if is_admin(message):
+            response["status"] = "OK"
+            response["metrics"] = metrics.snapshot()
+            print(f"{timestamp}: {client_port}: Metrics sent to admin.")
+        else:
+            response["status"] = "FAIL"
+            response["reason"] = "Not authorised."
+            print(
+                f"{timestamp}: {client_port}: STATS request refused for '{message.get('username')}'."
+            )
+
+        server_socket.sendto(encode_message(**response), client_address)
+
+    elif message_type == "PROFILE":
+        response = {"type": "PROFILE_RESPONSE"}
+        try:
+            seconds = float(message.get("seconds", 10))
+        except (TypeError, ValueError):
+            seconds = None
+        if not is_admin(message):
+            response["status"] = "FAIL"
+            response["reason"] = "Not authorised."
+            print(
+                f"{timestamp}: {client_port}: PROFILE request refused for '{message.get('username')}'."
+            )
+        elif seconds is None or not 0 < seconds <= PROFILE_MAX_SECONDS:
+            response["status"] = "FAIL"
+            response["reason"] = f"Duration must be between 0 and {PROFILE_MAX_SECONDS} seconds."
+        else:
+            filename = profiler.start(seconds)
+            if filename:
+                response["status"] = "OK"
+                response["seconds"] = seconds
+                response["report"] = filename
+                print(
+                    f"{timestamp}: {client_port}: Profiling for {seconds}s, report will be written to '{filename}'."
+                )
+            else:
+                response["status"] = "FAIL"
+                response["reason"] = "A profile capture is already running."
+
+        server_socket.sendto(encode_message(**response), client_address)
+
     else:
         print(
             f"{timestamp}: {client_port}: Received unknown message type from {client_address}: {message_type}"
@@ -296,7 +358,7 @@ def remove_inactive_users():
     while True:
         time.sleep(1)
         current_time = time.time()
-        with lock:
+        with metrics.locked(lock, "INACTIVE_SWEEP"):
             inactive_users = [
                 username
                 for username, user in active_users.items()
@@ -310,6 +372,8 @@ def remove_inactive_users():
 
 
 threading.Thread(target=remove_inactive_users, daemon=True).start()
+if METRICS_FILE:
+    start_periodic_dump(metrics, METRICS_FILE, METRICS_INTERVAL)
 
 while True:
     try: